@@ -4,10 +4,14 @@ import os
 import csv
 import time
 import zipfile
-import io
+import sys
+import shutil
+import uuid
 from date_utils import parse_date
 from download_api import download_vessel_track_data
-from path_utils import get_output_dir_path
+from path_utils import get_output_dir_path, final_result_dir_path
+from track_index import CountingWriter, TrackIndex
+from profiling import profile_run, profiler
 
 # --- 網頁設定 ---
 st.set_page_config(page_title="船舶軌跡下載神器", page_icon="🚢", layout="wide")
@@ -29,6 +33,11 @@ with st.sidebar:
         
     sleep_sec = st.number_input("每艘船間隔 (秒)", min_value=1, value=60, help="避免請求太快被封鎖，建議 60 秒")
     
+    # 只有用 streamlit run app.py -- --profile 啟動時才提供，一般訪客不能開啟
+    profile_mode = False
+    if "--profile" in sys.argv:
+        profile_mode = st.checkbox("🔬 效能分析模式", value=True, help="記錄各階段的時間與記憶體峰值，結束後輸出報告")
+    
     st.info("💡 提示：因為有設定冷卻時間，請耐心等候倒數結束。")
 
 # --- 主要內容區 ---
@@ -49,8 +58,25 @@ with col_status:
         st.info("👈 請在左側輸入資料並按下開始...")
         
 # --- 核心邏輯 ---
-async def process_download(api_key, mmsi_list, start_dt, end_dt, sleep_sec, status_placeholders):
-    temp_dir = "./temp_web"
+# 每次下載各自一個資料夾，不同 session 下載同一艘船也不會互相覆蓋
+WEB_RUNS_DIR = "./results_web"
+RUN_MAX_AGE_SEC = 24 * 60 * 60
+
+
+def cleanup_old_runs():
+    """刪除超過保存期限的下載資料夾"""
+    if not os.path.isdir(WEB_RUNS_DIR):
+        return
+    now = time.time()
+    for name in os.listdir(WEB_RUNS_DIR):
+        path = os.path.join(WEB_RUNS_DIR, name)
+        if now - os.path.getmtime(path) > RUN_MAX_AGE_SEC:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+async def process_download(api_key, mmsi_list, start_dt, end_dt, sleep_sec, status_placeholders, run_dir):
+    temp_dir = f"{run_dir}/temp"
+    results_dir = f"{run_dir}/results"
     results = [] 
     
     # 解包佔位符
@@ -89,26 +115,41 @@ async def process_download(api_key, mmsi_list, start_dt, end_dt, sleep_sec, stat
                     # 模擬合併檔案邏輯 (簡化版)
                     output_dir = get_output_dir_path(mmsi, temp_dir)
                     if os.path.exists(output_dir):
-                        csv_buffer = io.StringIO()
-                        writer = None
-                        all_files = sorted([f for f in os.listdir(output_dir) if f.endswith(".csv")])
+                        with profiler.stage("merge"):
+                            # 合併結果寫到磁碟，讓結果瀏覽可以用索引隨機讀取
+                            final_dir = final_result_dir_path(mmsi, results_dir)
+                            os.makedirs(final_dir, exist_ok=True)
+                            combined_path = f"{final_dir}/vessel_track_{mmsi}_combined.csv"
+                            all_files = sorted([f for f in os.listdir(output_dir) if f.endswith(".csv")])
                         
-                        header_saved = False
-                        for f in all_files:
-                            with open(os.path.join(output_dir, f), "r", encoding="utf-8") as infile:
-                                reader = csv.reader(infile)
-                                try:
-                                    header = next(reader)
-                                    if not header_saved:
-                                        writer = csv.writer(csv_buffer)
-                                        writer.writerow(header)
-                                        header_saved = True
-                                    for row in reader:
-                                        writer.writerow(row)
-                                except StopIteration:
-                                    pass
+                            # 邊寫邊記下每列的位置，索引跟著結果一起存檔，瀏覽時不用重新掃描
+                            header_saved = False
+                            track_index = None
+                            with open(combined_path, "wb") as outfile:
+                                sink = CountingWriter(outfile)
+                                writer = None
+                                for f in all_files:
+                                    with open(os.path.join(output_dir, f), "r", newline="", encoding="utf-8") as infile:
+                                        reader = csv.reader(infile)
+                                        try:
+                                            header = next(reader)
+                                            if not header_saved:
+                                                writer = csv.writer(sink)
+                                                writer.writerow(header)
+                                                track_index = TrackIndex(combined_path, header)
+                                                header_saved = True
+                                            for row in reader:
+                                                # 空白列不寫入也不建索引，和 TrackIndex.build 一致
+                                                if not row:
+                                                    continue
+                                                track_index.add(sink.pos, row)
+                                                writer.writerow(row)
+                                        except StopIteration:
+                                            pass
+                            if track_index is not None:
+                                track_index.save()
                         
-                        results.append({"filename": f"vessel_{mmsi}.csv", "data": csv_buffer.getvalue()})
+                        results.append({"mmsi": mmsi, "filename": f"vessel_{mmsi}.csv", "path": combined_path})
                         
                         logs.append(f"[{time.strftime('%H:%M:%S')}] ✅ 成功下載！")
                         success = True
@@ -120,13 +161,14 @@ async def process_download(api_key, mmsi_list, start_dt, end_dt, sleep_sec, stat
             # 失敗重試的冷卻
             if not success and attempt < max_retries:
                 logs.append(f"[{time.strftime('%H:%M:%S')}] ⚠️ 下載失敗，進入重試冷卻 (120秒)...")
-                for i in range(120, 0, -1):
-                    main_status.markdown(f"""
-                    ### ⚠️ 暫時受阻，準備重試
-                    **MMSI:** `{mmsi}`  
-                    **狀態:** ❄️ 冷卻中，剩餘 **{i}** 秒...
-                    """)
-                    time.sleep(1)
+                with profiler.stage("sleep"):
+                    for i in range(120, 0, -1):
+                        main_status.markdown(f"""
+                        ### ⚠️ 暫時受阻，準備重試
+                        **MMSI:** `{mmsi}`  
+                        **狀態:** ❄️ 冷卻中，剩餘 **{i}** 秒...
+                        """)
+                        time.sleep(1)
                 logs.append(f"[{time.strftime('%H:%M:%S')}] 🔄 重試中...")
 
         # 更新進度條
@@ -137,16 +179,17 @@ async def process_download(api_key, mmsi_list, start_dt, end_dt, sleep_sec, stat
         if current_num < total:
             if success:
                 # 倒數計時顯示
-                for i in range(sleep_sec, 0, -1):
-                    main_status.markdown(f"""
-                    ### ☕ 休息一下 (防封鎖機制)
-                    **上一艘:** `{mmsi}` (成功)  
-                    **下一艘:** `{mmsi_list[index+1]}`  
-                    **狀態:** ⏳ 倒數 **{i}** 秒後繼續...
-                    """)
-                    # 更新顏色條讓它看起來在動
-                    progress_bar.progress(current_num / total, text=f"等待冷卻中... {i}s")
-                    time.sleep(1)
+                with profiler.stage("sleep"):
+                    for i in range(sleep_sec, 0, -1):
+                        main_status.markdown(f"""
+                        ### ☕ 休息一下 (防封鎖機制)
+                        **上一艘:** `{mmsi}` (成功)  
+                        **下一艘:** `{mmsi_list[index+1]}`  
+                        **狀態:** ⏳ 倒數 **{i}** 秒後繼續...
+                        """)
+                        # 更新顏色條讓它看起來在動
+                        progress_bar.progress(current_num / total, text=f"等待冷卻中... {i}s")
+                        time.sleep(1)
             else:
                 logs.append(f"[{time.strftime('%H:%M:%S')}] ❌ 放棄此艘，繼續下一艘")
     
@@ -159,6 +202,36 @@ async def process_download(api_key, mmsi_list, start_dt, end_dt, sleep_sec, stat
     
     return results
 
+def run_download(api_key, mmsi_list, start_dt, end_dt, sleep_sec, placeholders):
+    """下載、合併並打包，結果存進 session_state"""
+    # 換掉這個 session 上一次的結果，順便清掉過期的資料夾
+    previous_run = st.session_state.pop("run_dir", None)
+    if previous_run:
+        shutil.rmtree(previous_run, ignore_errors=True)
+    cleanup_old_runs()
+    run_dir = f"{WEB_RUNS_DIR}/{uuid.uuid4().hex}"
+    st.session_state["run_dir"] = run_dir
+    
+    # 執行
+    results = asyncio.run(process_download(api_key, mmsi_list, start_dt, end_dt, sleep_sec, placeholders, run_dir))
+    # 分段檔案合併完就用不到了
+    shutil.rmtree(f"{run_dir}/temp", ignore_errors=True)
+    
+    if results:
+        # 打包 ZIP (只在下載完成時做一次)，存在這次的資料夾，session_state 只記路徑
+        zip_path = f"{run_dir}/vessel_tracks.zip"
+        with profiler.stage("package"):
+            with zipfile.ZipFile(zip_path, "w") as zf:
+                for item in results:
+                    zf.write(item["path"], arcname=item["filename"])
+        
+        st.session_state["results"] = results
+        st.session_state["zip_path"] = zip_path
+    else:
+        st.session_state.pop("results", None)
+        st.session_state.pop("zip_path", None)
+        st.warning("沒有成功下載任何資料。")
+
 # --- 按鈕觸發 ---
 if btn_start:
     if not api_key:
@@ -185,24 +258,90 @@ if btn_start:
                 'log': ph_log
             }
         
-        # 執行
-        results = asyncio.run(process_download(api_key, mmsi_list, start_date, end_date, sleep_sec, placeholders))
-        
-        if results:
-            st.success("檔案打包完成！請點擊下方按鈕下載。")
-            
-            # 打包 ZIP
-            zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(zip_buffer, "w") as zf:
-                for item in results:
-                    zf.writestr(item["filename"], item["data"])
-            
+        if not profile_mode:
+            run_download(api_key, mmsi_list, start_date, end_date, sleep_sec, placeholders)
+        else:
+            # 每次分析各自一份資料，中途被重新執行打斷也一定會停止
+            with profile_run() as run:
+                if run is None:
+                    st.warning("已有其他效能分析在執行，這次不做分析。")
+                    run_download(api_key, mmsi_list, start_date, end_date, sleep_sec, placeholders)
+                else:
+                    try:
+                        run_download(api_key, mmsi_list, start_date, end_date, sleep_sec, placeholders)
+                    finally:
+                        run.stop()
+                        table_path, folded_path = run.write_report()
+                    
+                    with st.expander("🔬 效能分析報告", expanded=True):
+                        st.code(run.format_table())
+                        st.caption(f"報告已輸出: {table_path}, {folded_path}")
+
+# --- 結果下載與瀏覽 ---
+# 結果放在 session_state，操作瀏覽元件造成的重新執行不會弄丟
+@st.cache_resource(max_entries=8)
+def load_track_index(path, mtime):
+    return TrackIndex.load(path)
+
+
+# 瀏覽元件只重新執行這一段，不會重跑整頁和下載按鈕
+@st.fragment
+def show_results_browser(results):
+    items = {item["mmsi"]: item for item in results}
+    col_vessel, col_page_size = st.columns([3, 1])
+    with col_vessel:
+        selected = st.selectbox("選擇船舶 (MMSI)", list(items))
+    with col_page_size:
+        page_size = st.selectbox("每頁筆數", [50, 100, 500, 1000], index=1)
+    
+    path = items[selected]["path"]
+    if not os.path.exists(path):
+        st.info("這份結果已過期被清除，請重新下載。")
+        return
+    index = load_track_index(path, os.path.getmtime(path))
+    
+    # 時間範圍篩選，用索引二分搜尋找出資料列範圍
+    lo, hi = 0, len(index)
+    bounds = index.time_bounds()
+    if bounds and bounds[0] < bounds[1]:
+        time_range = st.slider(
+            "時間範圍",
+            min_value=bounds[0],
+            max_value=bounds[1],
+            value=bounds,
+            format="YYYY-MM-DD HH:mm",
+        )
+        lo, hi = index.row_range(time_range[0], time_range[1])
+    elif index.time_error:
+        st.warning(f"無法依時間篩選: {index.time_error}")
+    
+    total_rows = hi - lo
+    total_pages = max(1, -(-total_rows // page_size))
+    page = st.number_input(f"頁數 (共 {total_pages} 頁，{total_rows} 筆)", min_value=1, max_value=total_pages, value=1)
+    
+    start = lo + (page - 1) * page_size
+    rows = index.read_rows(start, min(start + page_size, hi))
+    st.dataframe([dict(zip(index.header, row)) for row in rows], use_container_width=True)
+    
+    # 地圖只畫降採樣後的點，資料量再大載入時間也固定
+    positions = index.sample_positions(lo, hi, max_points=5000)
+    if positions["lat"]:
+        st.caption(f"地圖顯示 {len(positions['lat'])} / {total_rows} 個點")
+        st.map(positions)
+
+
+if st.session_state.get("results"):
+    zip_path = st.session_state["zip_path"]
+    if os.path.exists(zip_path):
+        st.success("檔案打包完成！請點擊下方按鈕下載。")
+        with open(zip_path, "rb") as zip_file:
             st.download_button(
                 label="📥 下載 ZIP 壓縮檔",
-                data=zip_buffer.getvalue(),
+                data=zip_file,
                 file_name="vessel_tracks.zip",
                 mime="application/zip",
                 use_container_width=True
             )
-        else:
-            st.warning("沒有成功下載任何資料。")
+    
+    st.subheader("🔍 3. 結果瀏覽")
+    show_results_browser(st.session_state["results"])
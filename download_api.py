@@ -6,6 +6,26 @@ from datetime import date
 from datetime import timedelta
 from date_utils import validate_dates
 from path_utils import get_output_dir_path, final_result_dir_path
+from profiling import profiler
+from track_parser import JSON_PROTOCOLS, JsonTrackParser, RecordCsvWriter
+
+
+async def _save_json_as_csv(response: httpx.Response, file_path: str) -> None:
+    """
+    Parses a JSON body as it arrives and stores the typed records as CSV
+    rows, so the merge only has to copy them.
+    """
+    parser = JsonTrackParser()
+    with open(file_path, "w", newline="", encoding="utf-8") as f:
+        writer = RecordCsvWriter(f)
+        async for chunk in response.aiter_bytes():
+            writer.write(parser.feed(chunk))
+        writer.write(parser.close())
+
+    print(f"Parsed {writer.count} records")
+    if writer.unknown_fields:
+        fields = ", ".join(f"{name} x{count}" for name, count in writer.unknown_fields.items())
+        print(f"Warning: fields not in the track header were left out: {fields}")
 
 
 async def fetch_vessel_track(
@@ -26,7 +46,7 @@ async def fetch_vessel_track(
         mmsi: Maritime Mobile Service Identity number
         from_date: Start date (YYYY-MM-DD or date object)
         to_date: End date (YYYY-MM-DD or date object)
-        protocol: Output format (default: csv)
+        protocol: Output format, csv, json or jsono (default: csv)
         version: API version (default: 3)
     """
     base_url = f"https://services.marinetraffic.com/api/exportvesseltrack/{api_key}"
@@ -44,14 +64,32 @@ async def fetch_vessel_track(
 
     try:
         async with httpx.AsyncClient() as client:
-            response = await client.get(base_url, params=params)
-            response.raise_for_status()
-
-            # Generate filename based on parameters
-            filename = f"vessel_track_{mmsi}_{from_date}_{to_date}.{protocol}"
-
-            with open(f"{output_dir}/{filename}", "wb") as f:
-                f.write(response.content)
+            async with client.stream("GET", base_url, params=params) as response:
+                if response.is_error:
+                    await response.aread()
+                response.raise_for_status()
+
+                # JSON chunks are stored as parsed CSV rows
+                extension = "csv" if protocol in JSON_PROTOCOLS else protocol
+
+                # Generate filename based on parameters
+                filename = f"vessel_track_{mmsi}_{from_date}_{to_date}.{extension}"
+                file_path = f"{output_dir}/{filename}"
+
+                # Write the body as it arrives instead of buffering it whole.
+                # One stage for the whole body keeps the per-chunk loop cheap
+                with profiler.stage("write"):
+                    if protocol in JSON_PROTOCOLS:
+                        try:
+                            await _save_json_as_csv(response, file_path)
+                        except ValueError:
+                            # An error object or a malformed body fails the chunk
+                            os.remove(file_path)
+                            raise
+                    else:
+                        with open(file_path, "wb") as f:
+                            async for chunk in response.aiter_bytes():
+                                f.write(chunk)
 
             print(f"Successfully downloaded: {filename}")
 
@@ -60,6 +98,10 @@ async def fetch_vessel_track(
     except httpx.HTTPStatusError as e:
         print(f"HTTP Error: {e.response.status_code} - {e.response.text}")
 
+        return False
+    except ValueError as e:
+        print(f"Invalid response: {e}")
+
         return False
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -67,22 +109,34 @@ async def fetch_vessel_track(
         return False
 
 
-async def download_vessel_track_data(
-    api_key: str, mmsi: str, start_date: date, end_date: date, temp_dir: str
-) -> None:
+def plan_chunks(
+    start_date: date, end_date: date, max_days: int = 180
+) -> list[tuple[date, date]]:
     """
-    Validates dates and downloads vessel track data, splitting into chunks if necessary.
+    Splits the interval into (from_date, to_date) chunks of at most
+    max_days, the longest interval a single request may cover.
     """
+    if (end_date - start_date).days <= max_days:
+        return [(start_date, end_date)]
+
+    chunks = []
+    current_start = start_date
+    # <= so a final one-day chunk is not dropped
+    while current_start <= end_date:
+        current_end = current_start + timedelta(days=max_days)
+        if current_end > end_date:
+            current_end = end_date
 
-    res = validate_dates(start_date, end_date)
-    if not (isinstance(res, tuple) and res[0] == "正確"):
-        print(f"Error: {res}")
-        return
+        chunks.append((current_start, current_end))
+        current_start = current_end + timedelta(days=1)
 
-    days = res[1]
+    return chunks
 
-    print(f"Correct, total days: {days}")
 
+def prepare_output_dir(mmsi: str, temp_dir: str) -> str:
+    """
+    Recreates an empty chunk directory for the vessel and returns its path.
+    """
     output_dir = get_output_dir_path(
         mmsi=mmsi,
         temp_dir=temp_dir,
@@ -93,14 +147,43 @@ async def download_vessel_track_data(
 
     os.makedirs(output_dir, exist_ok=True)
 
+    return output_dir
+
+
+async def download_vessel_track_data(
+    api_key: str,
+    mmsi: str,
+    start_date: date,
+    end_date: date,
+    temp_dir: str,
+    protocol: str = "csv",
+) -> None:
+    """
+    Validates dates and downloads vessel track data, splitting into chunks if necessary.
+    """
+
+    with profiler.stage("plan"):
+        res = validate_dates(start_date, end_date)
+        if not (isinstance(res, tuple) and res[0] == "正確"):
+            print(f"Error: {res}")
+            return
+
+        days = res[1]
+
+        print(f"Correct, total days: {days}")
+
+        output_dir = prepare_output_dir(mmsi=mmsi, temp_dir=temp_dir)
+
     if days <= 180:
-        res = await fetch_vessel_track(
-            api_key=api_key,
-            mmsi=mmsi,
-            from_date=start_date,
-            to_date=end_date,
-            output_dir=output_dir,
-        )
+        with profiler.stage("fetch"):
+            res = await fetch_vessel_track(
+                api_key=api_key,
+                mmsi=mmsi,
+                from_date=start_date,
+                to_date=end_date,
+                protocol=protocol,
+                output_dir=output_dir,
+            )
 
         if not res:
             print("Failed to download vessel track data")
@@ -111,29 +194,26 @@ async def download_vessel_track_data(
     else:
         print(f"Interval is {days} days (> 180), splitting requests...")
 
-        current_start = start_date
-        while current_start < end_date:
-            current_end = current_start + timedelta(days=180)
-            if current_end > end_date:
-                current_end = end_date
-
-            res = await fetch_vessel_track(
-                api_key=api_key,
-                mmsi=mmsi,
-                from_date=current_start,
-                to_date=current_end,
-                output_dir=output_dir,
-            )
+        chunks = plan_chunks(start_date, end_date)
+        for index, (current_start, current_end) in enumerate(chunks):
+            with profiler.stage("fetch"):
+                res = await fetch_vessel_track(
+                    api_key=api_key,
+                    mmsi=mmsi,
+                    from_date=current_start,
+                    to_date=current_end,
+                    protocol=protocol,
+                    output_dir=output_dir,
+                )
 
             if not res:
                 print("Failed to download vessel track data")
                 return False
 
-            current_start = current_end + timedelta(days=1)
-
             # If we haven't reached the end, sleep
-            if current_start < end_date:
+            if index < len(chunks) - 1:
                 print("Sleeping for 60 seconds between chunks...")
-                await asyncio.sleep(60)
+                with profiler.stage("sleep"):
+                    await asyncio.sleep(60)
 
         return True
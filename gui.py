@@ -7,18 +7,21 @@ import os
 import shutil
 import csv
 import time  # 引入時間模組
+import argparse
 from dotenv import load_dotenv
 from date_utils import parse_date
 # 引用原本的模組
 from download_api import download_vessel_track_data
 from path_utils import get_output_dir_path, final_result_dir_path
+from profiling import profile_run, profiler
 
 # 載入 .env
 load_dotenv()
 
 class VesselApp:
-    def __init__(self, root):
+    def __init__(self, root, profile=False):
         self.root = root
+        self.profile = profile  # 效能分析模式
         self.root.title("船舶資料批次下載器 (防封鎖版)")
         self.root.geometry("600x700")  # 視窗大小
         
@@ -123,6 +126,27 @@ class VesselApp:
         threading.Thread(target=self.run_process, args=(api_key, mmsi_list, start_date, end_date, int(sleep_sec)), daemon=True).start()
 
     def run_process(self, api_key, mmsi_list, from_date, to_date, sleep_sec):
+        """執行批次處理，效能分析模式下另外輸出報告"""
+        if not self.profile:
+            self.run_batch(api_key, mmsi_list, from_date, to_date, sleep_sec)
+            return
+
+        with profile_run() as run:
+            if run is None:
+                self.log("⚠️ 已有其他效能分析在執行，這次不做分析")
+                self.run_batch(api_key, mmsi_list, from_date, to_date, sleep_sec)
+                return
+
+            self.log("🔬 效能分析模式已開啟")
+            try:
+                self.run_batch(api_key, mmsi_list, from_date, to_date, sleep_sec)
+            finally:
+                run.stop()
+                self.log(run.format_table())
+                table_path, folded_path = run.write_report()
+                self.log(f"效能報告已輸出: {table_path}, {folded_path}")
+
+    def run_batch(self, api_key, mmsi_list, from_date, to_date, sleep_sec):
         """批次處理邏輯"""
         try:
             loop = asyncio.new_event_loop()
@@ -158,7 +182,8 @@ class VesselApp:
                         fail_count += 1
                     else:
                         self.log(f"正在合併檔案...")
-                        self.combine_files(mmsi, temp_dir, results_dir)
+                        with profiler.stage("merge"):
+                            self.combine_files(mmsi, temp_dir, results_dir)
                         self.log(f"✅ MMSI {mmsi} 完成。")
                         success_count += 1
                 
@@ -169,7 +194,8 @@ class VesselApp:
                 # --- 休息時間 ---
                 if current_num < total: # 如果不是最後一艘，就休息
                     self.log(f"⏳ 休息 {sleep_sec} 秒後繼續...")
-                    time.sleep(sleep_sec)
+                    with profiler.stage("sleep"):
+                        time.sleep(sleep_sec)
             
             # --- 迴圈結束 ---
             self.log(f"========================================")
@@ -223,6 +249,10 @@ class VesselApp:
                         continue
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile", action="store_true", help="輸出各階段的效能分析報告到 ./profile")
+    args = parser.parse_args()
+
     root = tk.Tk()
-    app = VesselApp(root)
+    app = VesselApp(root, profile=args.profile)
     root.mainloop()
\ No newline at end of file
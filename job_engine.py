@@ -0,0 +1,177 @@
+import asyncio
+import heapq
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, Callable
+from download_api import fetch_vessel_track, plan_chunks, prepare_output_dir
+from profiling import profiler
+
+
+@dataclass
+class Job:
+    mmsi: str
+    from_date: date
+    to_date: date
+    protocol: str = "csv"
+    priority: int = 0
+    name: str = ""
+
+
+class RateLimiter:
+    """
+    Spaces request starts at least `interval` seconds apart across every
+    worker, so the API budget is shared instead of split per vessel.
+    """
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self._lock = asyncio.Lock()
+        self._next_slot = 0.0
+        self._changed = asyncio.Event()
+
+    def wake(self) -> None:
+        """Makes a waiting acquire() check has_work() again before its slot."""
+        self._changed.set()
+
+    async def acquire(
+        self, take: Callable[[], Any], has_work: Callable[[], bool]
+    ) -> Any:
+        """
+        Waits for the next request slot and returns take() once it is due.
+
+        Returns None as soon as has_work() is False, also while waiting, so
+        idle workers do not sleep out a slot. The slot is only used up when
+        take() returns an item.
+        """
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            while True:
+                if not has_work():
+                    return None
+
+                wait = self._next_slot - loop.time()
+                if wait <= 0:
+                    break
+
+                self._changed.clear()
+                with profiler.stage("sleep"):
+                    try:
+                        await asyncio.wait_for(self._changed.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+
+            item = take()
+            if item is not None:
+                self._next_slot = loop.time() + self.interval
+
+            return item
+
+
+async def run_jobs(
+    api_key: str,
+    jobs: list[Job],
+    temp_dir: str,
+    *,
+    max_concurrency: int = 1,
+    request_interval: float = 60,
+    on_job_done: Callable[[Job], None] | None = None,
+) -> dict[str, bool]:
+    """
+    Downloads every job through one shared, rate-limited worker pool.
+
+    All chunks of all jobs go into a single priority queue, so chunks of
+    higher-priority jobs are requested first and a worker never waits on
+    one vessel while another still has work. on_job_done runs in a thread
+    as soon as the last chunk of a job is in, e.g. to merge its files,
+    while the workers go on with other chunks.
+
+    Returns a mapping of MMSI to whether the job succeeded.
+    """
+    queue: list[tuple] = []
+    pending: dict[str, int] = {}
+    failed: set[str] = set()
+    results: dict[str, bool] = {}
+    finishing: list[asyncio.Task] = []
+
+    with profiler.stage("plan"):
+        for order, job in enumerate(jobs):
+            output_dir = prepare_output_dir(mmsi=job.mmsi, temp_dir=temp_dir)
+            chunks = plan_chunks(job.from_date, job.to_date)
+            pending[job.mmsi] = len(chunks)
+
+            for seq, (from_date, to_date) in enumerate(chunks):
+                # Higher priority first, then config order, then chronological
+                key = (-job.priority, order, seq)
+                heapq.heappush(queue, (key, job, from_date, to_date, output_dir))
+
+    limiter = RateLimiter(request_interval)
+
+    async def finish_job(job: Job) -> None:
+        try:
+            await asyncio.to_thread(on_job_done, job)
+        except Exception as e:
+            print(f"An error occurred while finishing MMSI {job.mmsi}: {e}")
+            results[job.mmsi] = False
+
+    def finish_chunk(job: Job) -> None:
+        pending[job.mmsi] -= 1
+        if pending[job.mmsi] > 0:
+            return
+
+        results[job.mmsi] = job.mmsi not in failed
+        if results[job.mmsi] and on_job_done is not None:
+            # Run it as its own task so this worker keeps using request slots
+            finishing.append(asyncio.create_task(finish_job(job)))
+
+    def has_live_chunk() -> bool:
+        """Drops the chunks of failed jobs from the head of the queue."""
+        while queue:
+            job = queue[0][1]
+            if job.mmsi not in failed:
+                return True
+            # A failed chunk fails the whole job, skip what is left of it
+            heapq.heappop(queue)
+            finish_chunk(job)
+
+        return False
+
+    def take_chunk() -> tuple | None:
+        """Pops the most urgent chunk whose job has not failed."""
+        if not has_live_chunk():
+            return None
+
+        _, job, from_date, to_date, output_dir = heapq.heappop(queue)
+        return job, from_date, to_date, output_dir
+
+    async def worker() -> None:
+        while True:
+            # The chunk is chosen when the slot is due, so a slot is never
+            # spent on a job that failed meanwhile, and a worker returns as
+            # soon as no live chunk is left instead of sleeping out a slot
+            chunk = await limiter.acquire(take_chunk, has_live_chunk)
+            if chunk is None:
+                return
+
+            job, from_date, to_date, output_dir = chunk
+            with profiler.stage("fetch"):
+                res = await fetch_vessel_track(
+                    api_key=api_key,
+                    mmsi=job.mmsi,
+                    from_date=from_date,
+                    to_date=to_date,
+                    protocol=job.protocol,
+                    output_dir=output_dir,
+                )
+
+            if not res:
+                print(f"Failed to download vessel track data for MMSI: {job.mmsi}")
+                failed.add(job.mmsi)
+                # Its queued chunks are no work anymore, a waiting worker may be done
+                limiter.wake()
+
+            finish_chunk(job)
+
+    await asyncio.gather(*(worker() for _ in range(max(1, max_concurrency))))
+    await asyncio.gather(*finishing)
+
+    return results
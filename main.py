@@ -1,13 +1,16 @@
 import os
 import shutil
+import argparse
 from dotenv import load_dotenv
 import csv
 import yaml
 import asyncio
-from date_utils import parse_date
-from download_api import download_vessel_track_data
+from date_utils import parse_date, validate_dates
 from download_api import fetch_vessel_track
+from job_engine import Job, run_jobs
 from path_utils import get_output_dir_path, final_result_dir_path
+from profiling import profile_run, profiler
+from track_parser import JSON_PROTOCOLS
 
 
 def combine_result_files(mmsi: str, temp_dir: str, results_dir: str) -> None:
@@ -38,6 +41,7 @@ def combine_result_files(mmsi: str, temp_dir: str, results_dir: str) -> None:
 
     combined_file_path = f"{final_result_dir}/vessel_track_{mmsi}_combined.csv"
 
+    # JSON chunks are already stored as CSV rows by the download
     csv_files = [f for f in os.listdir(output_dir) if f.endswith(".csv")]
     csv_files.sort()  # Sort to maintain chronological order
 
@@ -66,6 +70,114 @@ def combine_result_files(mmsi: str, temp_dir: str, results_dir: str) -> None:
     print(f"Successfully combined all files into: {combined_file_path}")
 
 
+def load_job_plan(config: dict) -> tuple[list[Job], list[str]]:
+    """
+    Builds the job list from config.yaml and validates every job, plus the
+    shared engine settings, up front.
+
+    Jobs come from the `jobs` list; an entry whose `mmsi` is a list is a
+    fleet group sharing one date range, protocol and priority. A config
+    without `jobs` falls back to the top-level mmsi/from_date/to_date.
+
+    Returns the jobs and a list of errors; the plan only runs if there
+    are no errors.
+    """
+    default_protocol = config.get("protocol", "csv")
+    entries = config.get("jobs")
+    if entries is None:
+        entries = [
+            {
+                "mmsi": config.get("mmsi"),
+                "from_date": config.get("from_date"),
+                "to_date": config.get("to_date"),
+            }
+        ]
+
+    jobs = []
+    errors = []
+    seen_mmsi = set()
+
+    max_concurrency = config.get("max_concurrency", 1)
+    if isinstance(max_concurrency, bool) or not isinstance(max_concurrency, int) or max_concurrency < 1:
+        errors.append(f"max_concurrency must be a positive integer, got {max_concurrency!r}")
+
+    request_interval = config.get("request_interval", 60)
+    if (
+        isinstance(request_interval, bool)
+        or not isinstance(request_interval, (int, float))
+        or request_interval < 0
+    ):
+        errors.append(f"request_interval must be a non-negative number, got {request_interval!r}")
+
+    if not isinstance(entries, list):
+        errors.append("jobs must be a list")
+        entries = []
+
+    for number, entry in enumerate(entries, start=1):
+        if not isinstance(entry, dict):
+            errors.append(f"job #{number}: must be a mapping")
+            continue
+
+        label = entry.get("name") or f"job #{number}"
+
+        mmsi_list = entry.get("mmsi")
+        if not isinstance(mmsi_list, list):
+            mmsi_list = [mmsi_list]
+        elif not mmsi_list:
+            errors.append(f"{label}: mmsi list is empty")
+            continue
+
+        from_date = entry.get("from_date")
+        to_date = entry.get("to_date")
+        protocol = entry.get("protocol", default_protocol)
+        priority = entry.get("priority", 0)
+
+        if not all(mmsi_list) or not from_date or not to_date:
+            errors.append(f"{label}: missing mmsi, from_date or to_date")
+            continue
+
+        try:
+            start_date = parse_date(from_date)
+            end_date = parse_date(to_date)
+        except ValueError as e:
+            errors.append(f"{label}: {e}")
+            continue
+
+        res = validate_dates(start_date, end_date)
+        if not isinstance(res, tuple):
+            errors.append(f"{label}: {res}")
+            continue
+
+        if protocol not in ("csv",) + JSON_PROTOCOLS:
+            errors.append(f"{label}: unsupported protocol {protocol!r}")
+            continue
+
+        if not isinstance(priority, int):
+            errors.append(f"{label}: priority must be an integer")
+            continue
+
+        for mmsi in mmsi_list:
+            mmsi = str(mmsi)
+            # Jobs share temp/result directories keyed by MMSI
+            if mmsi in seen_mmsi:
+                errors.append(f"{label}: MMSI {mmsi} appears in more than one job")
+                continue
+            seen_mmsi.add(mmsi)
+
+            jobs.append(
+                Job(
+                    mmsi=mmsi,
+                    from_date=start_date,
+                    to_date=end_date,
+                    protocol=protocol,
+                    priority=priority,
+                    name=label,
+                )
+            )
+
+    return jobs, errors
+
+
 async def main():
     load_dotenv()
 
@@ -79,38 +191,72 @@ async def main():
 
     # Configuration
     API_KEY = os.getenv("MARINE_TRAFFIC_API_KEY")
-    MMSI = config.get("mmsi")
-    FROM_DATE = config.get("from_date")
-    TO_DATE = config.get("to_date")
     TEMP_DIR = config.get("temp_dir")
     RESULTS_DIR = config.get("results_dir")
+    MAX_CONCURRENCY = config.get("max_concurrency", 1)
+    REQUEST_INTERVAL = config.get("request_interval", 60)
 
-    if not all([API_KEY, MMSI, FROM_DATE, TO_DATE]):
-        print(
-            "Error: Missing required configuration (API_KEY, MMSI, FROM_DATE, or TO_DATE)."
-        )
+    if not API_KEY:
+        print("Error: Missing required configuration (API_KEY).")
         return
 
-    start_date = parse_date(FROM_DATE)
-    end_date = parse_date(TO_DATE)
+    # Validate the whole plan before any request is made
+    with profiler.stage("plan"):
+        jobs, errors = load_job_plan(config)
 
-    res = await download_vessel_track_data(
-        api_key=API_KEY,
-        mmsi=MMSI,
-        start_date=start_date,
-        end_date=end_date,
-        temp_dir=TEMP_DIR,
-    )
+    if errors:
+        print("Error: Invalid job configuration:")
+        for error in errors:
+            print(f"  - {error}")
+        return
 
-    if not res:
+    if not jobs:
+        print("Error: No jobs configured.")
         return
 
-    combine_result_files(
-        mmsi=MMSI,
-        temp_dir=TEMP_DIR,
-        results_dir=RESULTS_DIR,
+    print(f"Running {len(jobs)} job(s) with concurrency {MAX_CONCURRENCY}...")
+
+    def merge_job(job: Job) -> None:
+        with profiler.stage("merge"):
+            combine_result_files(
+                mmsi=job.mmsi,
+                temp_dir=TEMP_DIR,
+                results_dir=RESULTS_DIR,
+            )
+
+    results = await run_jobs(
+        API_KEY,
+        jobs,
+        TEMP_DIR,
+        max_concurrency=MAX_CONCURRENCY,
+        request_interval=REQUEST_INTERVAL,
+        on_job_done=merge_job,
     )
 
+    succeeded = [mmsi for mmsi, ok in results.items() if ok]
+    failed = [mmsi for mmsi, ok in results.items() if not ok]
+    print(f"Finished: {len(succeeded)} succeeded, {len(failed)} failed.")
+    if failed:
+        print(f"Failed MMSI: {', '.join(failed)}")
+
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile each pipeline stage and write a report to ./profile",
+    )
+    args = parser.parse_args()
+
+    if not args.profile:
+        asyncio.run(main())
+    else:
+        with profile_run() as run:
+            try:
+                asyncio.run(main())
+            finally:
+                run.stop()
+                print(run.format_table())
+                table_path, folded_path = run.write_report()
+                print(f"Profile report written to: {table_path}, {folded_path}")
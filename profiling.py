@@ -0,0 +1,263 @@
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+
+@dataclass
+class StageStats:
+    calls: int = 0
+    wall: float = 0.0
+    cpu: float = 0.0
+    peak: int = 0
+    samples: int = 0
+
+
+@dataclass
+class _OpenStage:
+    name: str
+    path: str
+    frame: object
+    wall_start: float
+    cpu_start: float
+    peak: int = 0
+
+
+# tracemalloc is process-wide, so only one profile run may be active at a time
+_run_lock = threading.Lock()
+
+# Profile run that stages in the current context report to
+_current: ContextVar["StageProfiler | None"] = ContextVar("current_profiler", default=None)
+
+_SKIP_FILES = (os.path.basename(__file__), "contextlib.py")
+
+
+def _caller_frame():
+    """The frame of the code that entered the stage."""
+    frame = sys._getframe(1)
+    while frame is not None and os.path.basename(frame.f_code.co_filename) in _SKIP_FILES:
+        frame = frame.f_back
+    return frame
+
+
+class StageProfiler:
+    """
+    Per-stage wall/CPU time and tracemalloc peak memory for one run, plus
+    a sampling profiler that writes flame-graph compatible folded stacks.
+
+    Stages nest and their numbers are inclusive of nested stages. A sample
+    is attributed to the innermost stage whose opening frame is on the
+    sampled stack, so concurrent asyncio tasks on one thread do not mix up
+    each other's stages. Wall time, CPU time and peak memory are measured
+    for the whole process and include work other tasks did meanwhile.
+    """
+
+    def __init__(self, interval: float = 0.005) -> None:
+        self.interval = interval
+        self.enabled = False
+        self.stats: dict[str, StageStats] = {}
+        self.stacks: Counter[str] = Counter()
+        self._stack: ContextVar[tuple[str, ...]] = ContextVar("stage_stack", default=())
+        self._open: list[_OpenStage] = []
+        self._threads: set[int] = set()
+        self._lock = threading.Lock()
+        self._sampler: threading.Thread | None = None
+        self._stop_event = threading.Event()
+        self._started_at = 0.0
+        self._stopped_at = 0.0
+
+    def start(self) -> bool:
+        """
+        Starts tracemalloc and the sampler. Returns False, without starting,
+        if another profile run is already active in this process.
+        """
+        if self.enabled:
+            return True
+        if not _run_lock.acquire(blocking=False):
+            return False
+
+        self._threads = {threading.get_ident()}
+        self._started_at = time.perf_counter()
+
+        tracemalloc.start()
+        self._stop_event.clear()
+        self._sampler = threading.Thread(target=self._sample_loop, daemon=True)
+        self._sampler.start()
+        self.enabled = True
+
+        return True
+
+    def stop(self) -> None:
+        if not self.enabled:
+            return
+
+        self.enabled = False
+        self._stopped_at = time.perf_counter()
+        self._stop_event.set()
+        self._sampler.join()
+        self._sampler = None
+        tracemalloc.stop()
+        _run_lock.release()
+
+    def _fold_peak(self) -> None:
+        # tracemalloc has a single peak, so fold it into every open stage
+        # before resetting it; this keeps overlapping stages correct
+        if not tracemalloc.is_tracing():
+            return
+
+        peak = tracemalloc.get_traced_memory()[1]
+        for open_stage in self._open:
+            open_stage.peak = max(open_stage.peak, peak)
+        tracemalloc.reset_peak()
+
+    @contextmanager
+    def stage(self, name: str):
+        if not self.enabled:
+            yield
+            return
+
+        stack = self._stack.get() + (name,)
+        token = self._stack.set(stack)
+
+        with self._lock:
+            self._fold_peak()
+            open_stage = _OpenStage(
+                name, ";".join(stack), _caller_frame(), time.perf_counter(), time.process_time()
+            )
+            self._open.append(open_stage)
+            self._threads.add(threading.get_ident())
+
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._fold_peak()
+                self._open.remove(open_stage)
+                open_stage.frame = None
+
+                stats = self.stats.setdefault(name, StageStats())
+                stats.calls += 1
+                stats.wall += time.perf_counter() - open_stage.wall_start
+                stats.cpu += time.process_time() - open_stage.cpu_start
+                stats.peak = max(stats.peak, open_stage.peak)
+
+            self._stack.reset(token)
+
+    def _sample_loop(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                # Later stages are innermost when two share a frame
+                stage_frames = {id(s.frame): s.path for s in self._open if s.frame is not None}
+
+                for thread_id in self._threads:
+                    frame = frames.get(thread_id)
+                    if frame is None:
+                        continue
+
+                    calls = []
+                    stage_path = None
+                    while frame is not None:
+                        if stage_path is None:
+                            stage_path = stage_frames.get(id(frame))
+                        code = frame.f_code
+                        filename = os.path.basename(code.co_filename)
+                        calls.append(f"{code.co_name} ({filename}:{code.co_firstlineno})")
+                        frame = frame.f_back
+                    calls.reverse()
+
+                    if stage_path:
+                        for name in set(stage_path.split(";")):
+                            self.stats.setdefault(name, StageStats()).samples += 1
+                        calls.insert(0, stage_path)
+                    else:
+                        calls.insert(0, "(no stage)")
+
+                    self.stacks[";".join(calls)] += 1
+
+    def format_table(self) -> str:
+        end = self._stopped_at or time.perf_counter()
+        total = end - self._started_at if self._started_at else 0.0
+        lines = [
+            f"{'stage':<10} {'calls':>7} {'wall s':>10} {'cpu s':>10} {'peak MB':>10} {'samples':>8}",
+            "-" * 60,
+        ]
+        for name, stats in sorted(self.stats.items(), key=lambda item: -item[1].wall):
+            lines.append(
+                f"{name:<10} {stats.calls:>7} {stats.wall:>10.3f} {stats.cpu:>10.3f} "
+                f"{stats.peak / 1024 / 1024:>10.2f} {stats.samples:>8}"
+            )
+        lines.append("-" * 60)
+        lines.append(f"total run time: {total:.3f} s (stage times include nested stages)")
+        lines.append(
+            "wall, cpu and peak are process-wide and include concurrent work of "
+            "other tasks; samples are attributed per task"
+        )
+
+        return "\n".join(lines)
+
+    def write_report(self, report_dir: str = "./profile") -> tuple[str, str]:
+        """
+        Writes the per-stage table and the folded stacks, which can be fed
+        to flamegraph.pl or speedscope. Returns both file paths.
+        """
+        os.makedirs(report_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%d_%H%M%S")
+        table_path = f"{report_dir}/profile_{stamp}_stages.txt"
+        folded_path = f"{report_dir}/profile_{stamp}.folded"
+
+        with open(table_path, "w", encoding="utf-8") as f:
+            f.write(self.format_table() + "\n")
+
+        with self._lock:
+            stacks = list(self.stacks.items())
+        with open(folded_path, "w", encoding="utf-8") as f:
+            for stack, count in stacks:
+                f.write(f"{stack} {count}\n")
+
+        return table_path, folded_path
+
+
+@contextmanager
+def profile_run():
+    """
+    Profiles the stages run in this context with a new StageProfiler.
+
+    Yields the profiler, or None if another run is already being profiled
+    in this process. The profiler is always stopped on exit, even when the
+    run raises; callers stop() it themselves first to write the report.
+    """
+    run = StageProfiler()
+    if not run.start():
+        yield None
+        return
+
+    token = _current.set(run)
+    try:
+        yield run
+    finally:
+        _current.reset(token)
+        run.stop()
+
+
+class _CurrentProfiler:
+    """Routes stage() to the profile run of the current context, if any."""
+
+    @contextmanager
+    def stage(self, name: str):
+        run = _current.get()
+        if run is None:
+            yield
+            return
+
+        with run.stage(name):
+            yield
+
+
+# Shared entry point for instrumented code in main.py, gui.py and app.py
+profiler = _CurrentProfiler()
@@ -0,0 +1,32 @@
+from datetime import date, timedelta
+
+from download_api import plan_chunks
+
+START = date(2023, 1, 1)
+
+
+def test_chunks_cover_every_day_once():
+    for days in range(0, 1501):
+        end = START + timedelta(days=days)
+        chunks = plan_chunks(START, end)
+
+        assert chunks[0][0] == START, days
+        assert chunks[-1][1] == end, days
+        for from_date, to_date in chunks:
+            assert from_date <= to_date, days
+            assert (to_date - from_date).days <= 180, days
+        for (_, previous_end), (next_start, _) in zip(chunks, chunks[1:]):
+            assert next_start == previous_end + timedelta(days=1), days
+
+
+def test_short_interval_is_one_chunk():
+    assert plan_chunks(START, date(2023, 3, 1)) == [(START, date(2023, 3, 1))]
+
+
+def test_last_single_day_is_kept():
+    end = START + timedelta(days=181)
+
+    assert plan_chunks(START, end) == [
+        (START, START + timedelta(days=180)),
+        (end, end),
+    ]
@@ -0,0 +1,112 @@
+import asyncio
+import time
+from datetime import date
+
+import pytest
+
+import job_engine
+from job_engine import Job, run_jobs
+
+
+class FakeApi:
+    """Stands in for fetch_vessel_track and records every request."""
+
+    def __init__(self, failing: set[str] = frozenset(), delay: float = 0.0) -> None:
+        self.failing = failing
+        self.delay = delay
+        self.calls: list[tuple[str, date, float]] = []
+
+    async def __call__(self, *, mmsi, from_date, to_date, **kwargs):
+        self.calls.append((mmsi, from_date, time.perf_counter()))
+        await asyncio.sleep(self.delay)
+        return mmsi not in self.failing
+
+
+@pytest.fixture
+def api(monkeypatch):
+    fake = FakeApi()
+    monkeypatch.setattr(job_engine, "fetch_vessel_track", fake)
+    return fake
+
+
+def run(jobs, tmp_path, **kwargs):
+    start = time.perf_counter()
+    results = asyncio.run(run_jobs("key", jobs, str(tmp_path), **kwargs))
+    return results, time.perf_counter() - start
+
+
+# 2023 is three chunks of at most 180 days
+YEAR = (date(2023, 1, 1), date(2023, 12, 31))
+WEEK = (date(2023, 1, 1), date(2023, 1, 7))
+
+
+def test_higher_priority_chunks_go_first(api, tmp_path):
+    jobs = [
+        Job("1", *YEAR),
+        Job("2", *YEAR, priority=5),
+        Job("3", *WEEK, priority=5),
+    ]
+
+    results, _ = run(jobs, tmp_path, request_interval=0)
+
+    assert results == {"1": True, "2": True, "3": True}
+    assert [mmsi for mmsi, _, _ in api.calls] == ["2", "2", "2", "3", "1", "1", "1"]
+    # Chunks of one job stay in chronological order
+    assert [d for mmsi, d, _ in api.calls if mmsi == "1"] == sorted(
+        d for mmsi, d, _ in api.calls if mmsi == "1"
+    )
+
+
+def test_failed_job_skips_its_remaining_chunks(api, tmp_path):
+    api.failing = {"2"}
+    done = []
+    jobs = [Job("1", *YEAR), Job("2", *YEAR, priority=5)]
+
+    results, _ = run(
+        jobs, tmp_path, request_interval=0, on_job_done=lambda job: done.append(job.mmsi)
+    )
+
+    assert results == {"1": True, "2": False}
+    assert [mmsi for mmsi, _, _ in api.calls] == ["2", "1", "1", "1"]
+    assert done == ["1"]
+
+
+def test_failing_merge_fails_the_job(api, tmp_path):
+    def on_job_done(job):
+        raise OSError("disk full")
+
+    results, _ = run([Job("1", *WEEK)], tmp_path, request_interval=0, on_job_done=on_job_done)
+
+    assert results == {"1": False}
+
+
+def test_requests_are_spaced_across_workers(api, tmp_path):
+    jobs = [Job("1", *WEEK), Job("2", *WEEK), Job("3", *WEEK)]
+
+    results, _ = run(jobs, tmp_path, max_concurrency=3, request_interval=0.1)
+
+    assert all(results.values())
+    starts = [started for _, _, started in api.calls]
+    assert all(b - a >= 0.09 for a, b in zip(starts, starts[1:]))
+
+
+def test_idle_workers_return_without_waiting_a_slot(api, tmp_path):
+    jobs = [Job("1", *WEEK), Job("2", *WEEK)]
+
+    results, elapsed = run(jobs, tmp_path, max_concurrency=4, request_interval=0.5)
+
+    assert all(results.values())
+    # One interval between the two requests, none after the last one
+    assert elapsed < 0.8
+
+
+def test_workers_return_when_only_failed_chunks_are_left(api, tmp_path):
+    api.failing = {"1"}
+    api.delay = 0.05
+
+    results, elapsed = run([Job("1", *YEAR)], tmp_path, max_concurrency=2, request_interval=1)
+
+    assert results == {"1": False}
+    assert len(api.calls) == 1
+    # The second worker was waiting for the next slot and is woken by the failure
+    assert elapsed < 0.5
@@ -0,0 +1,125 @@
+import csv
+import os
+from datetime import datetime
+
+from track_index import CountingWriter, TrackIndex, index_path
+
+HEADER = ["MMSI", "LON", "LAT", "TIMESTAMP"]
+
+
+def make_rows(count: int, start_minute: int = 0) -> list[list[str]]:
+    rows = []
+    for i in range(count):
+        hour, minute = divmod(start_minute + i, 60)
+        rows.append(["416123456", f"121.{i:03d}", f"25.{i:03d}", f"2024-01-01T{hour:02d}:{minute:02d}:00"])
+    return rows
+
+
+def write_indexed(path: str, rows: list[list[str]]) -> TrackIndex:
+    """Writes a combined CSV the way the merge does and returns its index."""
+    index = TrackIndex(path, HEADER)
+    with open(path, "wb") as f:
+        sink = CountingWriter(f)
+        writer = csv.writer(sink)
+        writer.writerow(HEADER)
+        for row in rows:
+            if not row:
+                continue
+            index.add(sink.pos, row)
+            writer.writerow(row)
+
+    return index
+
+
+def test_offsets_point_at_their_rows(tmp_path):
+    path = str(tmp_path / "combined.csv")
+    rows = make_rows(5)
+    rows[2] = ["416123456", "121.5", "25.5", "2024-01-01T00:02:00", "多位元組, 引號\""]
+    index = write_indexed(path, rows)
+
+    assert len(index) == 5
+    for i, row in enumerate(rows):
+        assert index.read_rows(i, i + 1) == [row]
+
+
+def test_blank_rows_do_not_shift_pages(tmp_path):
+    path = str(tmp_path / "combined.csv")
+    rows = make_rows(6)
+    index = write_indexed(path, rows[:2] + [[]] + rows[2:4] + [[], []] + rows[4:])
+
+    assert len(index) == 6
+    assert index.read_rows(2, 4) == rows[2:4]
+    assert index.read_rows(4, 6) == rows[4:]
+
+
+def test_build_skips_blank_lines(tmp_path):
+    path = str(tmp_path / "combined.csv")
+    rows = make_rows(4)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        writer.writerows(rows[:2])
+        f.write("\r\n\r\n")
+        writer.writerows(rows[2:])
+
+    index = TrackIndex.build(path)
+
+    assert len(index) == 4
+    assert index.read_rows(2, 4) == rows[2:]
+
+
+def test_saved_index_matches_a_rebuilt_one(tmp_path):
+    path = str(tmp_path / "combined.csv")
+    index = write_indexed(path, make_rows(100))
+    index.save()
+
+    loaded = TrackIndex.load(path)
+    built = TrackIndex.build(path)
+
+    for other in (loaded, built):
+        assert other.header == HEADER
+        assert list(other.offsets) == list(index.offsets)
+        assert list(other.times) == list(index.times)
+        assert list(other.lats) == list(index.lats)
+        assert list(other.lons) == list(index.lons)
+
+
+def test_missing_index_is_built_and_saved(tmp_path):
+    path = str(tmp_path / "combined.csv")
+    write_indexed(path, make_rows(10))
+
+    index = TrackIndex.load(path)
+
+    assert len(index) == 10
+    assert os.path.exists(index_path(path))
+
+
+def test_row_range_selects_by_time(tmp_path):
+    path = str(tmp_path / "combined.csv")
+    index = write_indexed(path, make_rows(60))
+
+    lo, hi = index.row_range(datetime(2024, 1, 1, 0, 10), datetime(2024, 1, 1, 0, 19))
+
+    assert (lo, hi) == (10, 20)
+    assert index.time_bounds() == (datetime(2024, 1, 1, 0, 0), datetime(2024, 1, 1, 0, 59))
+
+
+def test_unsorted_timestamps_disable_time_filtering(tmp_path):
+    path = str(tmp_path / "combined.csv")
+    rows = make_rows(3, start_minute=30) + make_rows(3)
+    index = write_indexed(path, rows)
+
+    assert not index.has_times
+    assert index.time_error
+    assert index.row_range(datetime(2024, 1, 1), datetime(2024, 1, 2)) == (0, 6)
+    assert index.read_rows(3, 6) == rows[3:]
+
+
+def test_sample_positions_are_capped(tmp_path):
+    path = str(tmp_path / "combined.csv")
+    index = write_indexed(path, make_rows(1000))
+
+    positions = index.sample_positions(0, len(index), max_points=100)
+
+    assert len(positions["lat"]) == 100
+    assert positions["lat"][0] == 25.0
@@ -0,0 +1,152 @@
+import csv
+import io
+import json
+from collections import Counter
+
+import pytest
+
+from track_parser import (
+    FIELD_NAMES,
+    JsonTrackParser,
+    RecordCsvWriter,
+    _convert,
+    iter_json_records,
+)
+
+ROWS = [
+    [416123456, 0, 12, 121.5, 25.1, 90, 91, "2024-01-01T00:00:00", 1, 0, 5, 20],
+    [416123456, 0, 13, 121.6, 25.2, 95, 96, "2024-01-01T00:10:00", 1, 0, 5, 21],
+    [416123456, 1, 0, 121.7, 25.3, 0, 511, "2024-01-01T00:20:00", 1, None, None, None],
+]
+
+
+def parse_in_pieces(body: bytes, size: int) -> list[dict]:
+    parser = JsonTrackParser()
+    records = []
+    for start in range(0, len(body), size):
+        records += parser.feed(body[start:start + size])
+    return records + parser.close()
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64])
+def test_split_boundaries_give_the_same_records(size):
+    body = json.dumps(ROWS).encode("utf-8")
+    expected = parse_in_pieces(body, len(body))
+
+    assert len(expected) == 3
+    assert parse_in_pieces(body, size) == expected
+
+
+def test_multibyte_characters_split_across_chunks():
+    body = json.dumps([{"TIMESTAMP": "2024-01-01", "名稱": "海龍號"}], ensure_ascii=False)
+    records = parse_in_pieces(body.encode("utf-8"), 1)
+
+    assert records == [{"TIMESTAMP": "2024-01-01", "名稱": "海龍號"}]
+
+
+def test_records_are_returned_before_the_array_ends():
+    parser = JsonTrackParser()
+    body = json.dumps(ROWS)
+
+    # Everything but the closing bracket: all three elements are complete
+    assert len(parser.feed(body[:-1].encode("utf-8"))) == 3
+    assert parser.feed(b"]") == []
+    assert parser.close() == []
+
+
+def test_array_of_arrays_uses_track_field_names():
+    (record,) = iter_json_records([json.dumps(ROWS[:1]).encode("utf-8")])
+
+    assert list(record) == FIELD_NAMES
+    assert record["LAT"] == 25.1
+    assert record["TIMESTAMP"] == "2024-01-01T00:00:00"
+
+
+def test_empty_body_has_no_records():
+    assert list(iter_json_records([b""])) == []
+    assert list(iter_json_records([b"[]"])) == []
+
+
+@pytest.mark.parametrize(
+    "body",
+    [b'{"errors": [{"code": "1", "detail": "INVALID API KEY"}]}', b"<html>busy</html>"],
+)
+def test_non_array_response_is_rejected(body):
+    with pytest.raises(ValueError, match="不是軌跡資料"):
+        list(iter_json_records([body]))
+
+
+@pytest.mark.parametrize("body", [b"[[1, 2], [3", b'[{"MMSI": "4161', b"[[1, tr"])
+def test_truncated_response_is_rejected_on_close(body):
+    parser = JsonTrackParser()
+    parser.feed(body)
+
+    with pytest.raises(ValueError, match="不完整"):
+        parser.close()
+
+
+@pytest.mark.parametrize(
+    "body",
+    [b"[[1, 2] [3]]", b"[[1, 2],, [3]]", b"[, [1]]", b"[[1, 2],]", b"[[1, 2], x]", b"[[1, 2}]"],
+)
+def test_malformed_response_is_rejected_while_feeding(body):
+    with pytest.raises(ValueError, match="無法解析"):
+        JsonTrackParser().feed(body)
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        (12, 12),
+        ("12", 12),
+        (12.0, 12),
+        ("12.0", 12),
+        (1.5, 1.5),
+        ("1.5", 1.5),
+        (None, None),
+        ("", None),
+    ],
+)
+def test_integer_fields_keep_decimals(value, expected):
+    result = _convert("SPEED", value)
+
+    assert result == expected
+    assert type(result) is type(expected)
+
+
+@pytest.mark.parametrize("value", ["fast", "nan", "inf", [1]])
+def test_invalid_values_become_empty_and_are_counted(value):
+    invalid = Counter()
+
+    assert _convert("SPEED", value, invalid) is None
+    assert invalid == {"SPEED": 1}
+
+
+def test_float_and_text_fields():
+    assert _convert("LAT", "25.5") == 25.5
+    assert _convert("LAT", 25) == 25.0
+    assert _convert("TIMESTAMP", "2024-01-01T00:00:00") == "2024-01-01T00:00:00"
+
+
+def test_parser_counts_invalid_values():
+    parser = JsonTrackParser()
+    records = parser.feed(b'[{"SPEED": "fast", "LAT": "north"}, {"SPEED": 3}]')
+
+    assert records == [{"SPEED": None, "LAT": None}, {"SPEED": 3}]
+    assert parser.invalid_values == {"SPEED": 1, "LAT": 1}
+
+
+def test_csv_header_does_not_depend_on_the_first_record():
+    out = io.StringIO()
+    writer = RecordCsvWriter(out)
+    writer.write([{"MMSI": 1, "TIMESTAMP": "2024-01-01T00:00:00"}])
+    writer.write([{"LAT": 25.1, "LON": 121.5, "MMSI": 1, "EXTRA": "x"}])
+
+    rows = list(csv.reader(io.StringIO(out.getvalue())))
+    assert rows[0] == FIELD_NAMES
+    first, second = (dict(zip(rows[0], row)) for row in rows[1:])
+    assert first["TIMESTAMP"] == "2024-01-01T00:00:00"
+    assert first["LAT"] == ""
+    assert (second["LAT"], second["LON"]) == ("25.1", "121.5")
+    assert writer.count == 2
+    assert writer.unknown_fields == {"EXTRA": 1}
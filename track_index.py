@@ -0,0 +1,237 @@
+import csv
+import json
+import math
+import os
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+INDEX_VERSION = 1
+
+
+def _column(header: list[str], name: str) -> int | None:
+    try:
+        return header.index(name)
+    except ValueError:
+        return None
+
+
+def _parse_float(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return math.nan
+
+
+def index_path(csv_path: str) -> str:
+    """The index of a combined CSV is stored next to it."""
+    return f"{csv_path}.idx"
+
+
+class CountingWriter:
+    """
+    Binary file wrapper for csv.writer that tracks the byte offset, so the
+    merge can record where every row starts while it writes it.
+    """
+
+    def __init__(self, f) -> None:
+        self.f = f
+        self.pos = 0
+
+    def write(self, text: str) -> None:
+        data = text.encode("utf-8")
+        self.f.write(data)
+        self.pos += len(data)
+
+
+class TrackIndex:
+    """
+    Row-offset index over a combined track CSV.
+
+    Holds the byte offset, timestamp and position of every row, so pages
+    and time ranges can be read by seeking instead of loading the whole
+    file. The merge fills it with add() while writing and save()s it next
+    to the CSV; load() reads it back and only scans the CSV if the saved
+    index is missing or stale.
+    """
+
+    def __init__(self, path: str, header: list[str]) -> None:
+        self.path = path
+        self.header = header
+        self.offsets = array("Q")
+        self.times = array("q")
+        self.lats = array("d")
+        self.lons = array("d")
+        # Reason time filtering is unavailable, None if it works
+        self.time_error: str | None = None
+        self.has_times = False
+        self.has_positions = False
+        self._time_col = _column(header, "TIMESTAMP")
+        self._lat_col = _column(header, "LAT")
+        self._lon_col = _column(header, "LON")
+
+        if self._time_col is None:
+            self.time_error = "沒有 TIMESTAMP 欄位"
+        else:
+            self.has_times = True
+        self.has_positions = self._lat_col is not None and self._lon_col is not None
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def add(self, offset: int, row: list) -> None:
+        """Records one row written at the given byte offset."""
+        self.offsets.append(offset)
+
+        if self.has_times:
+            try:
+                ts = int(datetime.fromisoformat(str(row[self._time_col])).timestamp())
+            except (IndexError, ValueError):
+                self._disable_times(f"第 {len(self.offsets)} 筆資料的時間格式不正確")
+            else:
+                # Range lookups bisect the timestamps, so they must not go back
+                if self.times and ts < self.times[-1]:
+                    self._disable_times(f"第 {len(self.offsets)} 筆資料的時間比前一筆早")
+                else:
+                    self.times.append(ts)
+
+        if self.has_positions:
+            if max(self._lat_col, self._lon_col) < len(row):
+                self.lats.append(_parse_float(row[self._lat_col]))
+                self.lons.append(_parse_float(row[self._lon_col]))
+            else:
+                self.lats.append(math.nan)
+                self.lons.append(math.nan)
+
+    def _disable_times(self, reason: str) -> None:
+        self.has_times = False
+        self.time_error = reason
+        self.times = array("q")
+
+    def save(self) -> None:
+        meta = {
+            "version": INDEX_VERSION,
+            "rows": len(self),
+            "header": self.header,
+            "has_times": self.has_times,
+            "has_positions": self.has_positions,
+            "time_error": self.time_error,
+        }
+        with open(index_path(self.path), "wb") as f:
+            f.write(json.dumps(meta).encode("utf-8") + b"\n")
+            self.offsets.tofile(f)
+            if self.has_times:
+                self.times.tofile(f)
+            if self.has_positions:
+                self.lats.tofile(f)
+                self.lons.tofile(f)
+
+    @classmethod
+    def load(cls, path: str) -> "TrackIndex":
+        """Reads the saved index of a CSV, rebuilding it if it is stale."""
+        idx_path = index_path(path)
+        if os.path.exists(idx_path) and os.path.getmtime(idx_path) >= os.path.getmtime(path):
+            with open(idx_path, "rb") as f:
+                meta = json.loads(f.readline())
+                if meta.get("version") == INDEX_VERSION:
+                    index = cls(path, meta["header"])
+                    rows = meta["rows"]
+                    index.offsets.fromfile(f, rows)
+                    index.has_times = meta["has_times"]
+                    index.has_positions = meta["has_positions"]
+                    index.time_error = meta["time_error"]
+                    if index.has_times:
+                        index.times.fromfile(f, rows)
+                    if index.has_positions:
+                        index.lats.fromfile(f, rows)
+                        index.lons.fromfile(f, rows)
+                    return index
+
+        index = cls.build(path)
+        index.save()
+        return index
+
+    @classmethod
+    def build(cls, path: str) -> "TrackIndex":
+        """Scans a combined CSV; only needed for files without a saved index."""
+        with open(path, "rb") as f:
+            header_line = f.readline()
+            header = next(csv.reader([header_line.decode("utf-8-sig")]), [])
+            index = cls(path, header)
+
+            # csv.reader pulls one line per row, so the offset of the line
+            # it last pulled is the offset of the row it yields
+            pos = {"line": 0, "next": f.tell()}
+
+            def lines():
+                for line in f:
+                    pos["line"] = pos["next"]
+                    pos["next"] += len(line)
+                    yield line.decode("utf-8")
+
+            for row in csv.reader(lines()):
+                if row:
+                    index.add(pos["line"], row)
+
+        return index
+
+    def time_bounds(self) -> tuple[datetime, datetime] | None:
+        if not self.has_times or not self.times:
+            return None
+
+        return (
+            datetime.fromtimestamp(self.times[0]),
+            datetime.fromtimestamp(self.times[-1]),
+        )
+
+    def row_range(
+        self, start: datetime | None = None, end: datetime | None = None
+    ) -> tuple[int, int]:
+        """Returns the [lo, hi) row numbers whose timestamps fall in the range."""
+        if not self.has_times:
+            return 0, len(self)
+
+        lo = 0 if start is None else bisect_left(self.times, int(start.timestamp()))
+        hi = len(self) if end is None else bisect_right(self.times, int(end.timestamp()))
+
+        return lo, max(lo, hi)
+
+    def read_rows(self, start: int, stop: int) -> list[list[str]]:
+        """Reads rows [start, stop) by seeking to the first one."""
+        start = max(0, start)
+        stop = min(len(self), stop)
+        if start >= stop:
+            return []
+
+        rows = []
+        with open(self.path, "rb") as f:
+            f.seek(self.offsets[start])
+            lines = (line.decode("utf-8") for line in f)
+            for row in csv.reader(lines):
+                if not row:
+                    continue
+                rows.append(row)
+                if len(rows) >= stop - start:
+                    break
+
+        return rows
+
+    def sample_positions(
+        self, lo: int, hi: int, max_points: int = 5000
+    ) -> dict[str, list[float]]:
+        """Evenly downsamples the positions of rows [lo, hi) for map rendering."""
+        if not self.has_positions or lo >= hi:
+            return {"lat": [], "lon": []}
+
+        step = max(1, math.ceil((hi - lo) / max_points))
+        lats = []
+        lons = []
+        for i in range(lo, hi, step):
+            lat = self.lats[i]
+            lon = self.lons[i]
+            if math.isnan(lat) or math.isnan(lon):
+                continue
+            lats.append(lat)
+            lons.append(lon)
+
+        return {"lat": lats, "lon": lons}
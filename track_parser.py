@@ -0,0 +1,215 @@
+import codecs
+import csv
+import json
+import math
+import re
+from collections import Counter
+from typing import Any, Iterable, Iterator
+
+# Column order of the MarineTraffic "json" protocol (array of arrays),
+# with the type each field is converted to. The "jsono" protocol uses the
+# same names as object keys.
+TRACK_FIELDS: tuple[tuple[str, type], ...] = (
+    ("MMSI", int),
+    ("STATUS", int),
+    ("SPEED", int),
+    ("LON", float),
+    ("LAT", float),
+    ("COURSE", int),
+    ("HEADING", int),
+    ("TIMESTAMP", str),
+    ("SHIP_ID", int),
+    ("WIND_ANGLE", int),
+    ("WIND_SPEED", int),
+    ("WIND_TEMP", int),
+)
+
+FIELD_TYPES = dict(TRACK_FIELDS)
+FIELD_NAMES = [name for name, _ in TRACK_FIELDS]
+
+JSON_PROTOCOLS = ("json", "jsono")
+
+_WHITESPACE = " \t\r\n"
+
+# What is left of a number or literal cut off at the end of the buffer
+_TRUNCATED_TOKEN = re.compile(r"[-+0-9.eE]*|t(r(ue?)?)?|f(a(l(se?)?)?)?|n(u(ll?)?)?")
+
+
+def _convert(name: str, value: Any, invalid: Counter | None = None) -> Any:
+    """
+    Converts a raw API value to the type declared for its field. A value
+    that does not convert becomes None and is counted in `invalid`.
+    """
+    if value is None or value == "":
+        return None
+
+    field_type = FIELD_TYPES.get(name)
+    if field_type is None or isinstance(value, field_type):
+        return value
+
+    if field_type is int:
+        # Integer fields sometimes come with decimals, e.g. SPEED 1.5 or
+        # "1.5"; keep the decimal value instead of truncating it
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            pass
+        else:
+            if number.is_integer():
+                return int(number)
+            if math.isfinite(number):
+                return number
+    else:
+        try:
+            return field_type(value)
+        except (TypeError, ValueError):
+            pass
+
+    if invalid is not None:
+        invalid[name] += 1
+
+    return None
+
+
+def to_record(item: list | dict, invalid: Counter | None = None) -> dict[str, Any]:
+    """Turns one element of a JSON track response into a typed record."""
+    if isinstance(item, dict):
+        return {name: _convert(name, value, invalid) for name, value in item.items()}
+
+    if isinstance(item, list):
+        record = {}
+        for index, value in enumerate(item):
+            name = FIELD_NAMES[index] if index < len(FIELD_NAMES) else f"COL_{index}"
+            record[name] = _convert(name, value, invalid)
+        return record
+
+    raise ValueError(f"無法解析的資料列: {item!r}")
+
+
+def _is_truncated(buf: str, error: json.JSONDecodeError) -> bool:
+    """
+    Tells a decode error caused by the buffer ending mid-element from one
+    caused by invalid JSON.
+    """
+    if error.pos >= len(buf) or error.msg.startswith("Unterminated string"):
+        return True
+
+    return _TRUNCATED_TOKEN.fullmatch(buf, error.pos) is not None
+
+
+class JsonTrackParser:
+    """
+    Incremental parser for MarineTraffic JSON track responses.
+
+    Bytes are fed as they arrive; every complete element of the top-level
+    array is returned as a typed record without waiting for the rest of
+    the document.
+    """
+
+    def __init__(self) -> None:
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._started = False
+        self._done = False
+        # Whether the last token was an element, so "," or "]" must follow
+        self._after_item = False
+        # Whether the last token was ",", so an element must follow
+        self._after_comma = False
+        self.invalid_values: Counter[str] = Counter()
+
+    def feed(self, data: bytes) -> list[dict[str, Any]]:
+        self._buf += self._text.decode(data)
+        return self._drain()
+
+    def close(self) -> list[dict[str, Any]]:
+        self._buf += self._text.decode(b"", final=True)
+        records = self._drain()
+
+        if not self._done:
+            if not self._started and not self._buf.strip():
+                # Empty body, nothing was returned for this chunk
+                return records
+            if not self._started:
+                # Not an array, e.g. an error object returned with status 200
+                raise ValueError(f"API 回應不是軌跡資料: {self._buf.strip()[:200]}")
+            raise ValueError("JSON 回應不完整")
+
+        if self.invalid_values:
+            fields = ", ".join(f"{name} x{count}" for name, count in self.invalid_values.items())
+            print(f"Warning: invalid values replaced with empty: {fields}")
+
+        return records
+
+    def _drain(self) -> list[dict[str, Any]]:
+        records = []
+        buf = self._buf
+        pos = 0
+        size = len(buf)
+
+        while not self._done:
+            while pos < size and buf[pos] in _WHITESPACE:
+                pos += 1
+            if pos >= size:
+                break
+
+            char = buf[pos]
+            if not self._started:
+                if char != "[":
+                    break
+                self._started = True
+                pos += 1
+            elif char == "," and self._after_item:
+                self._after_item = False
+                self._after_comma = True
+                pos += 1
+            elif char == "]" and not self._after_comma:
+                self._done = True
+                pos += 1
+            elif char in "[{" and not self._after_item:
+                try:
+                    item, pos = self._decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError as e:
+                    if _is_truncated(buf, e):
+                        # Element is not complete yet, wait for more bytes
+                        break
+                    raise ValueError(f"無法解析的 JSON 內容: {e}")
+                records.append(to_record(item, self.invalid_values))
+                self._after_item = True
+                self._after_comma = False
+            else:
+                raise ValueError(f"無法解析的 JSON 內容: {buf[pos:pos + 50]!r}")
+
+        self._buf = buf[pos:]
+        return records
+
+
+class RecordCsvWriter:
+    """
+    Writes typed records as CSV rows under the fixed FIELD_NAMES header.
+
+    The header does not depend on which keys the first record has; keys
+    outside FIELD_NAMES are left out and counted in unknown_fields.
+    """
+
+    def __init__(self, f) -> None:
+        self._writer = csv.writer(f)
+        self._writer.writerow(FIELD_NAMES)
+        self.count = 0
+        self.unknown_fields: Counter[str] = Counter()
+
+    def write(self, records: list[dict[str, Any]]) -> None:
+        for record in records:
+            for name in record:
+                if name not in FIELD_TYPES:
+                    self.unknown_fields[name] += 1
+            self._writer.writerow([record.get(name) for name in FIELD_NAMES])
+        self.count += len(records)
+
+
+def iter_json_records(chunks: Iterable[bytes]) -> Iterator[dict[str, Any]]:
+    """Yields typed records from an iterable of raw JSON byte chunks."""
+    parser = JsonTrackParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.close()